@@ -25,6 +25,7 @@ class Config:
     # Пути
     UPLOAD_FOLDER = 'uploads/'
     EXPORT_FOLDER = 'exports/'
+    EXPORT_JOB_TTL = 600  # секунды хранения неполученного экспорта
     
     @staticmethod
     def init_app(app):
@@ -1,10 +1,17 @@
-from flask import Flask, render_template, jsonify, request, send_file, session
+from flask import Flask, render_template, jsonify, request, send_file, session, current_app
 from flask_cors import CORS
+import atexit
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
 import json
 import os
+import uuid
+import orjson
 from datetime import datetime
+from sqlalchemy import create_engine
 
 from config import Config
 from src.flower_shop import RealTimeFlowerShop
@@ -18,23 +25,38 @@ CORS(app)
 # Инициализация базы данных
 init_db(app)
 
-# Глобальные переменные
-shop = None
-dashboard = None
-simulation_thread = None
-is_running = False
-
-@app.before_first_request
-def initialize():
-    """Инициализация при первом запросе"""
-    global shop, dashboard
-    if shop is None:
-        shop = RealTimeFlowerShop(
-            initial_budget=app.config['INITIAL_BUDGET'],
-            daily_customers=app.config['DAILY_CUSTOMERS']
-        )
-        dashboard = RealTimeDashboard(shop)
-    print("✅ Система инициализирована")
+@dataclass
+class ShopState:
+    """Состояние симуляции приложения, хранится в app.extensions['shop']"""
+    shop: RealTimeFlowerShop
+    dashboard: RealTimeDashboard = field(init=False)
+    running: threading.Event = field(default_factory=threading.Event)
+    stop_requested: threading.Event = field(default_factory=threading.Event)
+    thread: Optional[threading.Thread] = None
+    lock: threading.Lock = field(default_factory=threading.Lock)  # запуск/остановка/сброс
+    
+    def __post_init__(self):
+        self.dashboard = RealTimeDashboard(self.shop)
+
+# Единый пул соединений; кэш подготовленных запросов sqlite3 увеличен до 256
+engine = create_engine(
+    app.config['SQLALCHEMY_DATABASE_URI'],
+    connect_args={'cached_statements': 256}
+)
+
+def create_shop():
+    """Создание магазина по настройкам приложения"""
+    return RealTimeFlowerShop(
+        initial_budget=app.config['INITIAL_BUDGET'],
+        daily_customers=app.config['DAILY_CUSTOMERS'],
+        engine=engine
+    )
+
+app.extensions['shop'] = ShopState(shop=create_shop())
+export_executor = ThreadPoolExecutor(max_workers=1)
+export_jobs = {}  # id задачи экспорта -> (Future с путем к архиву, время создания)
+export_jobs_lock = threading.Lock()
+print("✅ Система инициализирована")
 
 @app.route('/')
 def index():
@@ -51,88 +73,167 @@ def database_page():
     """Страница управления базой данных"""
     return render_template('database.html')
 
+def orjson_response(payload):
+    """JSON-ответ, сериализованный через orjson (быстрее стандартного jsonify)"""
+    return app.response_class(orjson.dumps(payload), mimetype='application/json')
+
+# Фоновая симуляция
+def run_simulation(state):
+    """Цикл симуляции: 1 секунда = 1 час, тики по монотонным часам без дрейфа"""
+    next_tick = time.monotonic()
+    while state.running.is_set():
+        state.shop.run_simulation_step()
+        next_tick += 1.0
+        # wait() просыпается сразу при остановке
+        if state.stop_requested.wait(max(0.0, next_tick - time.monotonic())):
+            break
+
+def halt_simulation(state):
+    """Остановка цикла симуляции и ожидание его завершения"""
+    state.running.clear()
+    state.stop_requested.set()
+    if state.thread is not None:
+        state.thread.join()
+
+def shutdown():
+    """Остановка симуляции и дозапись очереди в БД при завершении процесса"""
+    state = app.extensions['shop']
+    with state.lock:
+        halt_simulation(state)
+        state.shop.close()
+
+# Цикл работает в daemon-потоке и не держит процесс; перед выходом его останавливаем
+atexit.register(shutdown)
+
 # API endpoints
 @app.route('/api/start', methods=['POST'])
 def start_simulation():
     """Запуск симуляции"""
-    global is_running, simulation_thread
+    state = current_app.extensions['shop']
     
-    if not is_running:
-        is_running = True
-        
-        def run_simulation():
-            while is_running:
-                shop.run_simulation_step()
-                time.sleep(1)  # 1 секунда = 1 час в симуляции
-        
-        simulation_thread = threading.Thread(target=run_simulation, daemon=True)
-        simulation_thread.start()
-        
-        return jsonify({'status': 'started', 'message': 'Симуляция запущена'})
+    with state.lock:
+        if not state.running.is_set():
+            # Остановленный цикл мог еще не закончить текущий шаг
+            if state.thread is not None:
+                state.thread.join()
+            state.stop_requested.clear()
+            state.running.set()
+            state.thread = threading.Thread(target=run_simulation, args=(state,), daemon=True)
+            state.thread.start()
+            
+            return jsonify({'status': 'started', 'message': 'Симуляция запущена'})
     
     return jsonify({'status': 'already_running', 'message': 'Симуляция уже запущена'})
 
 @app.route('/api/stop', methods=['POST'])
 def stop_simulation():
     """Остановка симуляции"""
-    global is_running
+    state = current_app.extensions['shop']
     
-    if is_running:
-        is_running = False
-        return jsonify({'status': 'stopped', 'message': 'Симуляция остановлена'})
+    with state.lock:
+        if state.running.is_set():
+            state.running.clear()
+            state.stop_requested.set()
+            return jsonify({'status': 'stopped', 'message': 'Симуляция остановлена'})
     
     return jsonify({'status': 'not_running', 'message': 'Симуляция не запущена'})
 
 @app.route('/api/reset', methods=['POST'])
 def reset_simulation():
     """Сброс симуляции"""
-    global shop, dashboard, is_running
+    state = current_app.extensions['shop']
     
-    is_running = False
-    time.sleep(1)  # Даем время остановиться
-    
-    shop = RealTimeFlowerShop(
-        initial_budget=app.config['INITIAL_BUDGET'],
-        daily_customers=app.config['DAILY_CUSTOMERS']
-    )
-    dashboard = RealTimeDashboard(shop)
+    with state.lock:
+        halt_simulation(state)  # Дожидаемся остановки вместо фиксированной паузы
+        state.shop.close()
+        
+        state.shop = create_shop()
+        state.dashboard = RealTimeDashboard(state.shop)
     
     return jsonify({'status': 'reset', 'message': 'Симуляция сброшена'})
 
 @app.route('/api/status')
 def get_status():
     """Получение текущего статуса"""
-    if shop is None:
-        return jsonify({'status': 'not_initialized'})
-    
-    data = shop.get_dashboard_data()
-    return jsonify({
-        'status': 'running' if is_running else 'stopped',
+    state = current_app.extensions['shop']
+    # Снимок уже сериализован симуляцией, вставляется без повторного разбора
+    data = orjson.Fragment(state.shop.get_cached_dashboard_json())
+    response = orjson_response({
+        'status': 'running' if state.running.is_set() else 'stopped',
         'data': data
     })
+    response.headers['Cache-Control'] = 'max-age=1, stale-while-revalidate=5'
+    return response
 
 @app.route('/api/recommendations/apply', methods=['POST'])
 def apply_recommendations():
     """Применение рекомендаций ML"""
-    if shop:
+    shop = current_app.extensions['shop'].shop
+    with shop.lock:  # не пересекается с шагом симуляции
         shop.generate_recommendations()
         shop.apply_recommendations()
-        return jsonify({'status': 'applied', 'message': 'Рекомендации применены'})
-    return jsonify({'status': 'error', 'message': 'Магазин не инициализирован'})
+        shop.refresh_dashboard_cache()
+    return jsonify({'status': 'applied', 'message': 'Рекомендации применены'})
 
 @app.route('/api/database/stats')
 def get_database_stats():
     """Получение статистики БД"""
     stats = get_db_stats()
-    return jsonify(stats)
+    return orjson_response(stats)
+
+def remove_export_file(future):
+    """Удаление архива экспорта, если задача его создала"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    try:
+        os.remove(future.result())
+    except OSError:
+        pass
+
+def expire_export_jobs():
+    """Удаление задач экспорта, которые не забрали за EXPORT_JOB_TTL"""
+    deadline = time.monotonic() - app.config['EXPORT_JOB_TTL']
+    with export_jobs_lock:
+        expired = [job_id for job_id, (_, created) in export_jobs.items() if created < deadline]
+        futures = [export_jobs.pop(job_id)[0] for job_id in expired]
+    for future in futures:
+        # Для незавершенной задачи архив удалится, когда она закончится
+        future.add_done_callback(remove_export_file)
 
 @app.route('/api/database/export')
 def export_database():
-    """Экспорт базы данных"""
+    """Запуск экспорта базы данных в фоне"""
+    expire_export_jobs()
+    
+    job_id = uuid.uuid4().hex
+    with export_jobs_lock:
+        export_jobs[job_id] = (export_executor.submit(export_database_csv), time.monotonic())
+    return jsonify({
+        'status': 'accepted',
+        'job_id': job_id,
+        'url': f'/api/database/export/{job_id}'
+    }), 202
+
+@app.route('/api/database/export/<job_id>')
+def download_export(job_id):
+    """Скачивание результата экспорта базы данных"""
+    expire_export_jobs()
+    
+    with export_jobs_lock:
+        job = export_jobs.get(job_id)
+        if job is None:
+            return jsonify({'status': 'error', 'message': 'Задача экспорта не найдена'}), 404
+        future = job[0]
+        if not future.done():
+            return jsonify({'status': 'pending', 'job_id': job_id}), 202
+        export_jobs.pop(job_id)
+    
     try:
-        filename = export_database_csv()
+        export_file = open(future.result(), 'rb')
+        # Открытый файл остается читаемым, архив на диске больше не нужен
+        remove_export_file(future)
         return send_file(
-            filename,
+            export_file,
             as_attachment=True,
             download_name=f'flower_shop_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.zip',
             mimetype='application/zip'
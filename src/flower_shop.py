@@ -1,15 +1,55 @@
 import numpy as np
-import pandas as pd
+import orjson
 from datetime import datetime, timedelta
-import random
-from sklearn.ensemble import RandomForestRegressor
-import sqlite3
+import threading
+import queue
 import os
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import SQLAlchemyError
+
+# SQL вставок собран один раз на уровне модуля: драйвер берет готовый
+# подготовленный запрос из кэша соединения
+_SALES_SQL = 'INSERT INTO sales (timestamp, flower, quantity, price, profit) VALUES (?, ?, ?, ?, ?)'
+_INVENTORY_SQL = 'INSERT INTO inventory (timestamp, flower, quantity, price) VALUES (?, ?, ?, ?)'
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Настройки производительности для каждого нового соединения SQLite"""
+    # Драйвер не открывает транзакции сам, BEGIN выдает _begin
+    dbapi_connection.isolation_level = None
+    
+    # WAL позволяет читателям из других потоков не блокировать запись
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA cache_size=-65536')  # 64 МБ
+    cursor.execute('PRAGMA mmap_size=268435456')  # 256 МБ
+    cursor.close()
+
+def _begin(conn):
+    """Начало транзакции: пишущие (immediate=True) сразу берут блокировку на запись"""
+    if conn.get_execution_options().get('immediate'):
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+    else:
+        # Читатели не блокируют писателя в режиме WAL
+        conn.exec_driver_sql('BEGIN')
+
+def configure_engine(engine):
+    """Подключение настроек SQLite к engine (повторный вызов безопасен)"""
+    if engine.dialect.name != 'sqlite':
+        return
+    if not event.contains(engine, 'connect', _set_sqlite_pragmas):
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+        event.listen(engine, 'begin', _begin)
 
 class RealTimeFlowerShop:
-    def __init__(self, initial_budget=1000000, daily_customers=5000):
+    def __init__(self, initial_budget=1000000, daily_customers=5000, seed=None, engine=None):
         self.budget = initial_budget
         self.daily_customers = daily_customers
+        self._rng = np.random.default_rng(seed)
+        # Блокировка состояния магазина: шаг симуляции, применение рекомендаций
+        # извне и обновление снимка dashboard выполняются под ней
+        self.lock = threading.RLock()
         
         # Цветы и характеристики
         self.flowers = {
@@ -25,6 +65,19 @@ class RealTimeFlowerShop:
         self.today_profit = {flower: 0.0 for flower in self.flowers}
         self.today_revenue = 0.0
         
+        # Характеристики цветов в виде параллельных массивов (для векторных расчетов)
+        self._names = tuple(self.flowers)
+        self._index = {flower: i for i, flower in enumerate(self._names)}
+        self._costs = np.array([s['cost'] for s in self.flowers.values()], dtype=np.float64)
+        self._popularity = np.array([s['popularity'] for s in self.flowers.values()], dtype=np.float64)
+        self._inventory_arr = np.array([self.inventory[f] for f in self._names], dtype=np.int64)
+        self._prices_arr = np.zeros(len(self._names), dtype=np.float64)
+        
+        # Множители спроса по часу суток и дню недели
+        self._hour_mul = np.full(24, 0.5)
+        self._hour_mul[[8, 12, 18, 20]] = [0.3, 0.8, 1.0, 0.5]
+        self._wk_mul = np.where(np.arange(7) >= 5, 1.3, 1.0)  # выходные
+        
         # ML модель
         self.demand_model = None
         self.current_recommendations = {
@@ -33,107 +86,156 @@ class RealTimeFlowerShop:
             'high_demand_flowers': []
         }
         
+        # Были ли продажи, изменения запасов или незакрытые закупки с последнего
+        # пересчета рекомендаций
+        self._dirty = True
+        # Какой способ оценки продаж (hour > 8) использовал последний пересчет
+        self._rec_sales_window = None
+        
+        # Кэш цен на текущий шаг симуляции
+        self._current_prices = {}
+        self.update_current_prices()
+        
         # База данных
         self.db_path = 'flower_shop.db'
+        # Общий пул соединений; без переданного engine создаем свой
+        if engine is None:
+            engine = create_engine(f'sqlite:///{self.db_path}', connect_args={'cached_statements': 256})
+        self.engine = engine
+        configure_engine(self.engine)
+        self._write_engine = self.engine.execution_options(immediate=True)  # для записи
+        self._pending_sales = []
+        self._pending_inventory = []
+        self._last_logged_inventory = {}  # последние записанные в БД (количество, цена)
         self.init_database()
+        
+        # Запись в БД в отдельном потоке: симуляция только кладет строки шага в очередь
+        self._write_q = queue.Queue(maxsize=10000)
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+        
+        # Снимок данных dashboard, обновляется симуляцией после каждого шага.
+        # Заранее собранная структура заполняется на месте и сразу сериализуется:
+        # читатели получают только готовые неизменяемые байты
+        self._dashboard_buf = self._new_dashboard_payload()
+        self._dashboard_json = b''
+        self.refresh_dashboard_cache()
     
     def init_database(self):
         """Инициализация базы данных"""
-        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        
-        # Таблица продаж
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sales (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME,
-                flower TEXT,
-                quantity INTEGER,
-                price REAL,
-                profit REAL
-            )
-        ''')
-        
-        # Таблица запасов
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS inventory (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME,
-                flower TEXT,
-                quantity INTEGER,
-                price REAL
-            )
-        ''')
-        
-        self.conn.commit()
+        with self._write_engine.begin() as conn:
+            # Таблица продаж
+            conn.execute(text('''
+                CREATE TABLE IF NOT EXISTS sales (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp DATETIME,
+                    flower TEXT,
+                    quantity INTEGER,
+                    price REAL,
+                    profit REAL
+                )
+            '''))
+            
+            # Таблица запасов
+            conn.execute(text('''
+                CREATE TABLE IF NOT EXISTS inventory (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp DATETIME,
+                    flower TEXT,
+                    quantity INTEGER,
+                    price REAL
+                )
+            '''))
+            
+            # Индексы для выборок по времени и цветку
+            conn.execute(text('CREATE INDEX IF NOT EXISTS idx_sales_ts_flower ON sales(timestamp, flower)'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS idx_inv_ts_flower ON inventory(timestamp, flower)'))
     
     def run_simulation_step(self):
         """Один шаг симуляции"""
+        with self.lock:
+            return self._simulation_step()
+    
+    def _simulation_step(self):
         self.current_time += timedelta(hours=1)
+        self.update_current_prices()
         
         # Генерация спроса
         hour = self.current_time.hour
         if 8 <= hour < 20:  # Магазин открыт
             hourly_demand = self.generate_daily_demand()
             
-            # Продажи по цветам
-            for flower, stats in self.flowers.items():
-                if self.inventory[flower] <= 0:
-                    continue
+            # Продажи по цветам (один векторный проход по всем цветам)
+            n = len(self._names)
+            self._prices_arr[:] = [self._current_prices[flower] for flower in self._names]
+            
+            shares = self._popularity * self._rng.uniform(0.8, 1.2, size=n)
+            demand = (hourly_demand * shares).astype(np.int64)
+            sales = np.minimum(demand, self._inventory_arr)
+            revenue = self._prices_arr * sales
+            profit = (self._prices_arr - self._costs) * sales
+            self._inventory_arr -= sales
+            
+            if sales.any():
+                self._dirty = True
+            self.today_revenue += float(revenue.sum())
+            self.budget += float(profit.sum())
+            
+            # Словари обновляем только для цветов с продажами (нужны для dashboard)
+            for i in np.flatnonzero(sales):
+                flower = self._names[i]
+                sold = int(sales[i])
+                flower_profit = float(profit[i])
                 
-                demand_share = stats['popularity'] * random.uniform(0.8, 1.2)
-                flower_demand = int(hourly_demand * demand_share)
-                possible_sales = min(flower_demand, self.inventory[flower])
+                self.inventory[flower] = int(self._inventory_arr[i])
+                self.today_sales[flower] += sold
+                self.today_profit[flower] += flower_profit
                 
-                if possible_sales > 0:
-                    current_price = self.get_current_price(flower)
-                    cost = stats['cost']
-                    
-                    revenue = current_price * possible_sales
-                    profit = (current_price - cost) * possible_sales
-                    
-                    self.inventory[flower] -= possible_sales
-                    self.today_sales[flower] += possible_sales
-                    self.today_profit[flower] += profit
-                    self.today_revenue += revenue
-                    self.budget += profit
-                    
-                    # Сохраняем в БД
-                    self.save_sale(flower, possible_sales, current_price, profit)
-        
-        # Каждые 4 часа обновляем рекомендации
-        if self.current_time.hour % 4 == 0:
+                # Сохраняем в БД
+                self.save_sale(flower, sold, float(self._prices_arr[i]), flower_profit)
+        
+        # Каждые 4 часа обновляем рекомендации, если их входные данные могли измениться
+        sales_window = self.current_time.hour > 8
+        if self.current_time.hour % 4 == 0 and (self._dirty or sales_window != self._rec_sales_window):
             self.generate_recommendations()
             self.apply_recommendations()
+            self._rec_sales_window = sales_window
+            # Пока закупки не закрыты, следующий пересчет тоже нужен
+            self._dirty = any(
+                s['suggestion'] != 'НОРМА'
+                for s in self.current_recommendations['purchase_suggestions'].values()
+            )
         
         # Сохраняем запасы
         self.save_inventory()
+        self.flush_pending()
+        self.refresh_dashboard_cache()
         
         return sum(self.today_sales.values()), sum(self.today_profit.values())
     
     def generate_daily_demand(self):
         """Генерация спроса"""
+        t = self.current_time
+        return int(self.daily_customers * self._hour_mul[t.hour] * self._wk_mul[t.weekday()]
+                   * self._rng.uniform(0.9, 1.1))
+    
+    def update_current_prices(self):
+        """Пересчет кэша цен (раз в шаг и после применения рекомендаций)"""
+        optimal_prices = self.current_recommendations['optimal_prices']
         hour = self.current_time.hour
-        hour_multipliers = {8: 0.3, 12: 0.8, 18: 1.0, 20: 0.5}
-        hour_mult = hour_multipliers.get(hour, 0.5)
+        evening = 18 <= hour <= 19
         
-        weekday = self.current_time.weekday()
-        weekday_mult = 1.3 if weekday >= 5 else 1.0
-        
-        return int(self.daily_customers * hour_mult * weekday_mult * random.uniform(0.9, 1.1))
+        for flower, stats in self.flowers.items():
+            if flower in optimal_prices:
+                self._current_prices[flower] = optimal_prices[flower]
+            elif evening:
+                self._current_prices[flower] = stats['base_price'] * 1.2
+            else:
+                self._current_prices[flower] = stats['base_price']
     
     def get_current_price(self, flower):
         """Получение текущей цены"""
-        base_price = self.flowers[flower]['base_price']
-        
-        if flower in self.current_recommendations['optimal_prices']:
-            optimal_price = self.current_recommendations['optimal_prices'][flower]
-            return optimal_price
-        
-        hour = self.current_time.hour
-        if 18 <= hour <= 19:
-            return base_price * 1.2
-        return base_price
+        return self._current_prices[flower]
     
     def generate_recommendations(self):
         """Генерация ML рекомендаций"""
@@ -185,42 +287,113 @@ class RealTimeFlowerShop:
                 
                 if self.budget >= cost and quantity > 0:
                     self.inventory[flower] += quantity
+                    self._inventory_arr[self._index[flower]] += quantity
                     self.budget -= cost
+                    self._dirty = True
+        
+        self.update_current_prices()
     
     def save_sale(self, flower, quantity, price, profit):
-        """Сохранение продажи в БД"""
-        self.cursor.execute('''
-            INSERT INTO sales (timestamp, flower, quantity, price, profit)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (self.current_time, flower, quantity, price, profit))
-        self.conn.commit()
+        """Добавление продажи в буфер записи"""
+        self._pending_sales.append((self.current_time, flower, quantity, price, profit))
     
     def save_inventory(self):
-        """Сохранение запасов в БД"""
+        """Добавление в буфер записи запасов, изменившихся с прошлой записи"""
         for flower, quantity in self.inventory.items():
-            self.cursor.execute('''
-                INSERT INTO inventory (timestamp, flower, quantity, price)
-                VALUES (?, ?, ?, ?)
-            ''', (self.current_time, flower, quantity, self.get_current_price(flower)))
-        self.conn.commit()
+            state = (quantity, self.get_current_price(flower))
+            if self._last_logged_inventory.get(flower) != state:
+                self._last_logged_inventory[flower] = state
+                self._pending_inventory.append((self.current_time, flower) + state)
+    
+    def flush_pending(self):
+        """Передача накопленных за шаг строк потоку записи"""
+        if not self._pending_sales and not self._pending_inventory:
+            return
+        
+        self._write_q.put((self._pending_sales, self._pending_inventory))
+        self._pending_sales = []
+        self._pending_inventory = []
+    
+    def _writer_loop(self):
+        """Поток записи: забирает из очереди все готовые шаги и пишет их одной транзакцией"""
+        while True:
+            batch = [self._write_q.get()]
+            while len(batch) < 1000:
+                try:
+                    batch.append(self._write_q.get_nowait())
+                except queue.Empty:
+                    break
+            
+            stop = None in batch
+            batch = [item for item in batch if item is not None]
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except SQLAlchemyError as e:
+                    print(f"❌ Ошибка записи в БД: {e}")
+                    # Потерянные строки запасов не попали в БД: следующий шаг
+                    # запишет полный снимок вместо изменений
+                    self._last_logged_inventory.clear()
+            if stop:
+                return
+    
+    def _write_batch(self, batch):
+        """Запись пачки шагов в БД одной транзакцией"""
+        sales = [row for sales_rows, _ in batch for row in sales_rows]
+        inventory = [row for _, inventory_rows in batch for row in inventory_rows]
+        
+        with self._write_engine.begin() as conn:
+            if sales:
+                conn.exec_driver_sql(_SALES_SQL, sales)
+            if inventory:
+                conn.exec_driver_sql(_INVENTORY_SQL, inventory)
+    
+    def close(self):
+        """Дописать очередь записи и остановить поток записи"""
+        self._write_q.put(None)
+        self._writer.join()
+    
+    def _new_dashboard_payload(self):
+        """Пустая структура данных dashboard со строками под каждый цветок"""
+        return {
+            'current_time': '',
+            'budget': 0,
+            'today_revenue': 0.0,
+            'today_profit': 0.0,
+            'today_sales': 0,
+            'inventory': [{'flower': flower} for flower in self._names],
+            'recommendations': {}
+        }
+    
+    def _fill_dashboard_data(self, payload):
+        """Заполнение структуры dashboard на месте, без создания новых строк"""
+        payload['current_time'] = self.current_time.strftime('%Y-%m-%d %H:%M')
+        payload['budget'] = self.budget
+        payload['today_revenue'] = self.today_revenue
+        payload['today_profit'] = sum(self.today_profit.values())
+        payload['today_sales'] = sum(self.today_sales.values())
+        
+        for row, flower in zip(payload['inventory'], self._names):
+            row['quantity'] = self.inventory[flower]
+            row['price'] = self.get_current_price(flower)
+            row['profit_today'] = self.today_profit[flower]
+            row['sales_today'] = self.today_sales[flower]
+        
+        payload['recommendations'] = self.current_recommendations
+        return payload
     
     def get_dashboard_data(self):
         """Получение данных для dashboard"""
-        return {
-            'current_time': self.current_time.strftime('%Y-%m-%d %H:%M'),
-            'budget': self.budget,
-            'today_revenue': self.today_revenue,
-            'today_profit': sum(self.today_profit.values()),
-            'today_sales': sum(self.today_sales.values()),
-            'inventory': [
-                {
-                    'flower': flower,
-                    'quantity': quantity,
-                    'price': self.get_current_price(flower),
-                    'profit_today': self.today_profit[flower],
-                    'sales_today': self.today_sales[flower]
-                }
-                for flower, quantity in self.inventory.items()
-            ],
-            'recommendations': self.current_recommendations
-        }
\ No newline at end of file
+        return self._fill_dashboard_data(self._new_dashboard_payload())
+    
+    def refresh_dashboard_cache(self):
+        """Пересчет снимка dashboard и его публикация в виде JSON"""
+        # Вызывается и из потока симуляции, и из обработчиков запросов; под
+        # блокировкой буфер заполняется и сериализуется, пока никто его не меняет
+        with self.lock:
+            payload = self._fill_dashboard_data(self._dashboard_buf)
+            self._dashboard_json = orjson.dumps(payload)
+    
+    def get_cached_dashboard_json(self):
+        """Последний готовый снимок данных для dashboard (JSON в байтах)"""
+        return self._dashboard_json
\ No newline at end of file
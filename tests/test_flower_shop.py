@@ -0,0 +1,74 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import orjson
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.flower_shop import RealTimeFlowerShop
+
+
+@pytest.fixture
+def shop(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # flower_shop.db создается в текущей директории
+    shop = RealTimeFlowerShop(seed=1)
+    yield shop
+    shop.close()
+
+
+def test_sales_continue_over_several_days(shop):
+    """Распроданные цветы докупаются, и продажи не падают до нуля"""
+    daily_sales = []
+    sold_before = 0
+    for _ in range(8):
+        for _ in range(24):
+            shop.run_simulation_step()
+        sold = sum(shop.today_sales.values())
+        daily_sales.append(sold - sold_before)
+        sold_before = sold
+    
+    assert all(sold > 0 for sold in daily_sales), daily_sales
+
+
+def test_reads_do_not_wait_for_writer(shop):
+    """Чтение через engine не берет блокировку на запись"""
+    with shop._write_engine.connect() as writer, writer.begin():
+        writer.exec_driver_sql('SELECT 1')  # BEGIN IMMEDIATE уже выполнен
+        with shop.engine.connect() as reader:
+            assert reader.execute(text('SELECT count(*) FROM sales')).scalar() == 0
+
+
+def test_inventory_is_rewritten_after_failed_write(shop):
+    """После ошибки записи следующий шаг пишет полный снимок запасов"""
+    failed = threading.Event()
+    
+    def failing_write(batch):
+        failed.set()
+        raise SQLAlchemyError('запись не удалась')
+    
+    shop.current_time = datetime(2026, 1, 1, 0, 0)  # ночь: продаж и изменений нет
+    shop._write_batch = failing_write
+    shop.run_simulation_step()
+    assert failed.wait(5)
+    del shop._write_batch
+    
+    deadline = time.monotonic() + 5
+    while shop._last_logged_inventory and time.monotonic() < deadline:
+        time.sleep(0.01)
+    
+    shop.run_simulation_step()
+    shop.close()
+    
+    rows = sqlite3.connect(shop.db_path).execute('SELECT COUNT(DISTINCT flower) FROM inventory').fetchone()
+    assert rows[0] == len(shop.flowers)
+
+
+def test_cached_dashboard_matches_current_state(shop):
+    """Снимок dashboard после шага совпадает с текущими данными магазина"""
+    for _ in range(30):
+        shop.run_simulation_step()
+    
+    assert orjson.loads(shop.get_cached_dashboard_json()) == orjson.loads(orjson.dumps(shop.get_dashboard_data()))